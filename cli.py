@@ -1,18 +1,135 @@
 import sys
+import json
+import contextlib
+import time
+import pickle
+import argparse
+from collections import deque
+from multiprocessing import Pool
 from core import *
 
-args = sys.argv
-regex = sys.argv[1]
-machine_type = int(sys.argv[2])
-test_cases = sys.argv[3:]
-
-if machine_type == 0:
-	d = FSMBuilder.build_determined(Lexer.tokenize(regex))
-	for case in test_cases:
-		print('d acceptance %s %s' % (case, d.acceptance(case)))
-elif machine_type == 1:
-	tokens_lists = [Lexer.tokenize(item.strip()) for item in regex.split(',')]
-	d = MooreMachineBuilder.build_determined(tokens_lists)
-elif machine_type == 2:
-	tokens_lists = [Lexer.tokenize(item.strip()) for item in regex.split(',')]
-	d = BuchiMachineBuilder.build_determined(tokens_lists)
+machine = None
+
+def build_machine(regex, machine_type, render=True):
+	with contextlib.redirect_stdout(sys.stderr):
+		if machine_type == 0:
+			tokens = Lexer.tokenize(regex)
+			if render:
+				return FSMBuilder.build_determined(tokens)
+			return FSMBuilder.determinize(FSMBuilder.build(tokens))
+		tokens_lists = [Lexer.tokenize(item.strip()) for item in regex.split(',')]
+		if machine_type == 1:
+			if render:
+				return MooreMachineBuilder.build_moore(tokens_lists)
+			return MooreMachineBuilder.determinize(MooreMachineBuilder.build(tokens_lists))
+		elif machine_type == 2:
+			if render:
+				return BuchiMachineBuilder.build_buchi(tokens_lists)
+			return BuchiMachineBuilder.determinize(BuchiMachineBuilder.build(tokens_lists))
+	raise ValueError('Unknown machine type')
+
+def load_machine(path):
+	with open(path, 'rb') as f:
+		return pickle.load(f)
+
+def init_worker(data):
+	global machine
+	machine = pickle.loads(data)
+
+def check_words(words):
+	return [(word, machine.acceptance(word)) for word in words]
+
+def read_chunks(stream, chunk_size):
+	chunk = []
+	for line in stream:
+		chunk.append(line.rstrip('\r\n'))
+		if len(chunk) == chunk_size:
+			yield chunk
+			chunk = []
+	if len(chunk) > 0:
+		yield chunk
+
+def format_result(word, result, output_format):
+	if output_format == 'jsonl':
+		return json.dumps({'word': word, 'result': result})
+	if result is None:
+		result = 'None'
+	elif type(result) == tuple:
+		result = ','.join(str(item) for item in result)
+	return '%s\t%s' % (word, result)
+
+def write_results(output, results, output_format):
+	output.write(''.join(format_result(word, result, output_format) + '\n' for word, result in results))
+	return len(results)
+
+def run_batch(args, output):
+	if args.input == '-':
+		stream = sys.stdin
+	else:
+		stream = open(args.input, encoding='utf-8')
+	count = 0
+	started = time.perf_counter()
+	try:
+		chunks = read_chunks(stream, args.chunk_size)
+		if args.workers > 0:
+			with Pool(args.workers, initializer=init_worker, initargs=(pickle.dumps(machine),)) as pool:
+				pending = deque()
+				for chunk in chunks:
+					pending.append(pool.apply_async(check_words, (chunk,)))
+					if len(pending) >= args.workers * 4:
+						count += write_results(output, pending.popleft().get(), args.format)
+				while len(pending) > 0:
+					count += write_results(output, pending.popleft().get(), args.format)
+		else:
+			for chunk in chunks:
+				count += write_results(output, check_words(chunk), args.format)
+	finally:
+		if stream is not sys.stdin:
+			stream.close()
+	output.flush()
+	elapsed = time.perf_counter() - started
+	rate = count / elapsed if elapsed > 0 else 0.0
+	print('processed %d words in %.3f s (%.0f words/s)' % (count, elapsed, rate), file=sys.stderr)
+
+def main():
+	parser = argparse.ArgumentParser(description='Build a machine from a regular expression and check word acceptance')
+	parser.add_argument('regex', nargs='?', help='regular expression (comma separated for machine types 1 and 2)')
+	parser.add_argument('machine_type', nargs='?', help='0 for FSM, 1 for Moore machine, 2 for Buchi machine')
+	parser.add_argument('words', nargs='*', help='words for acceptance testing (with --load-machine, all positional arguments are words)')
+	parser.add_argument('--input', help='read words from this file, one per line ("-" for stdin)')
+	parser.add_argument('--output', help='write batch results to this file instead of stdout')
+	parser.add_argument('--format', choices=['jsonl', 'tsv'], default='jsonl', help='batch output format')
+	parser.add_argument('--workers', type=int, default=0, help='number of worker processes for batch mode')
+	parser.add_argument('--chunk-size', type=int, default=10000, help='words per worker task in batch mode')
+	parser.add_argument('--load-machine', help='load a compiled machine saved with --save-machine')
+	parser.add_argument('--save-machine', help='save the compiled machine to this file')
+	args = parser.parse_args()
+
+	global machine
+	if args.load_machine is not None:
+		machine = load_machine(args.load_machine)
+		args.words = [item for item in [args.regex, args.machine_type] if item is not None] + args.words
+	elif args.regex is None or args.machine_type is None:
+		parser.error('regex and machine_type are required unless --load-machine is given')
+	elif args.machine_type not in ['0', '1', '2']:
+		parser.error("argument machine_type: invalid choice: '%s' (choose from 0, 1, 2)" % args.machine_type)
+	elif args.input is not None:
+		machine = build_machine(args.regex, int(args.machine_type), render=False).compile()
+	else:
+		machine = build_machine(args.regex, int(args.machine_type)).compile()
+	if args.save_machine is not None:
+		with open(args.save_machine, 'wb') as f:
+			pickle.dump(machine, f)
+
+	for case in args.words:
+		print('d acceptance %s %s' % (case, machine.acceptance(case)))
+
+	if args.input is not None:
+		if args.output is not None:
+			with open(args.output, 'w', encoding='utf-8') as output:
+				run_batch(args, output)
+		else:
+			run_batch(args, sys.stdout)
+
+if __name__ == '__main__':
+	main()
@@ -1,6 +1,20 @@
-from graphviz import Digraph
+import os
+import mmap
+import array
+import itertools
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from types import MappingProxyType
+try:
+	from graphviz import Digraph
+except ImportError:
+	Digraph = None
 
 class Token:
+	__slots__ = ('content',)
+
 	def __init__(self, initializer):
 		self.content = initializer
 
@@ -11,36 +25,128 @@ class Token:
 		raise NotImplementedError('Method parse is not implemented in Token class')
 
 class LetterToken(Token):
+	__slots__ = ()
+	__letters = {}
+
+	@classmethod
+	def get(cls, char):
+		try:
+			return cls.__letters[char]
+		except KeyError:
+			return cls.__letters.setdefault(char, LetterToken(char))
+
 	def parse(self):
-		return LetterToken(self.content)
+		return self
 
 class SequenceToken(Token):
+	__slots__ = ()
+
 	def parse(self):
 		if '|' in self.content:
 			return DisjunctionToken([SequenceToken(item) for item in self.content.split('|')]).parse()
 		else:
-			return [LetterToken(item) for item in self.content]
+			return [LetterToken.get(item) for item in self.content]
 
 class RegexToken(Token):
+	__slots__ = ()
+
 	def parse(self):
 		return Lexer.tokenize(self.content)
 
 class DisjunctionToken(Token):
+	__slots__ = ()
+
 	def parse(self):
 		return DisjunctionToken([item.parse() for item in self.content])
 
 class GroupToken(Token):
+	__slots__ = ()
+
 	def parse(self):
 		return GroupToken(RegexToken(self.content[1:-1]).parse())
 
 class IterationToken(Token):
+	__slots__ = ()
+
 	def parse(self):
 		return IterationToken(RegexToken(self.content[1:-1]).parse())
 
 class StrongIterationToken(Token):
+	__slots__ = ()
+
 	def parse(self):
 		return StrongIterationToken(RegexToken(self.content[1:-1]).parse())
 
+class RegexNode:
+	__slots__ = ('content', 'hash', 'serial', '__weakref__')
+	__nodes = weakref.WeakValueDictionary()
+	__serials = itertools.count()
+	__lock = threading.Lock()
+
+	def __new__(cls, *content):
+		key = (cls, content)
+		with RegexNode.__lock:
+			node = RegexNode.__nodes.get(key)
+			if node is None:
+				node = object.__new__(cls)
+				object.__setattr__(node, 'content', content)
+				object.__setattr__(node, 'hash', hash(key))
+				object.__setattr__(node, 'serial', next(RegexNode.__serials))
+				RegexNode.__nodes[key] = node
+		return node
+
+	def __setattr__(self, name, value):
+		raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+	def __hash__(self):
+		return self.hash
+
+	def __reduce__(self):
+		return (self.__class__, self.content)
+
+	def __repr__(self):
+		return self.__class__.__name__ + '(' + ', '.join(repr(item) for item in self.content) + ')'
+
+	@classmethod
+	def from_tokens(cls, tokens):
+		if type(tokens) == list:
+			items = []
+			for token in tokens:
+				node = cls.from_tokens(token)
+				if type(node) == SequenceNode:
+					items += node.content
+				else:
+					items.append(node)
+			if len(items) == 1:
+				return items[0]
+			return SequenceNode(*items)
+		elif type(tokens) == LetterToken:
+			return LetterNode(tokens.content)
+		elif type(tokens) == GroupToken:
+			return cls.from_tokens(tokens.content)
+		elif type(tokens) == DisjunctionToken:
+			return DisjunctionNode(*[cls.from_tokens(item) for item in tokens.content])
+		elif type(tokens) == IterationToken:
+			return IterationNode(cls.from_tokens(tokens.content))
+		elif type(tokens) == StrongIterationToken:
+			return StrongIterationNode(cls.from_tokens(tokens.content))
+		raise ValueError('Incorrect token')
+
+class LetterNode(RegexNode):
+	__slots__ = ()
+
+class SequenceNode(RegexNode):
+	__slots__ = ()
+
+class DisjunctionNode(RegexNode):
+	__slots__ = ()
+
+class IterationNode(RegexNode):
+	__slots__ = ()
+
+class StrongIterationNode(RegexNode):
+	__slots__ = ()
+
 class Lexer:
 	@classmethod
 	def __parse_groups(cls, regex):
@@ -108,7 +214,7 @@ class Lexer:
 	def __make_plane(cls, parsed):
 		result = []
 		for item in parsed:
-			if type(item) == type([]):
+			if type(item) == list:
 				result += item
 			else:
 				result.append(item)
@@ -118,6 +224,103 @@ class Lexer:
 	def tokenize(cls, regex):
 		return cls.__make_plane(cls.__outer_parse(cls.__parse_groups(regex)))
 
+	@classmethod
+	def parse(cls, regex):
+		return RegexNode.from_tokens(cls.tokenize(regex))
+
+class DotWriter:
+	@classmethod
+	def __quote(cls, text):
+		return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+	SPECIAL_CHARS = ",-'\""
+
+	@classmethod
+	def merge_label(cls, chars):
+		chars = sorted(chars)
+		singles = [char for char in chars if len(char) == 1 and char not in cls.SPECIAL_CHARS]
+		parts = []
+		i = 0
+		while i < len(singles):
+			j = i
+			while j + 1 < len(singles) and ord(singles[j + 1]) == ord(singles[j]) + 1:
+				j += 1
+			if j - i >= 2:
+				parts.append(singles[i] + '-' + singles[j])
+			else:
+				parts += singles[i:j + 1]
+			i = j + 1
+		parts += [repr(char) for char in chars if len(char) == 1 and char in cls.SPECIAL_CHARS]
+		return ','.join(parts + [char for char in chars if len(char) != 1])
+
+	@classmethod
+	def __select(cls, states, initial_state, selected, hops, max_states):
+		if selected is None and hops is None:
+			included = list(states)
+			if max_states is None:
+				return included
+		else:
+			neighbours = {}
+			for state in states:
+				for char in states[state]:
+					for target in states[state][char]:
+						neighbours.setdefault(state, set()).add(target)
+						neighbours.setdefault(target, set()).add(state)
+			if selected is None:
+				selected = [initial_state]
+			included = []
+			depth = {}
+			queue = deque()
+			for state in selected:
+				if state not in states:
+					raise ValueError('State does not exist in machine')
+				if state not in depth:
+					depth[state] = 0
+					included.append(state)
+					queue.append(state)
+			while len(queue) > 0:
+				state = queue.popleft()
+				if hops is not None and depth[state] >= hops:
+					continue
+				for target in sorted(neighbours.get(state, ())):
+					if target not in depth:
+						depth[target] = depth[state] + 1
+						included.append(target)
+						queue.append(target)
+		if max_states is not None:
+			included = included[:max_states]
+		return included
+
+	@classmethod
+	def write(cls, path, states, final_states, initial_state, node_label, selected=None, hops=None, max_states=None):
+		included = cls.__select(states, initial_state, selected, hops, max_states)
+		shown = set(included)
+		final = set(final_states)
+		hidden = len(states) - len(shown)
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write('digraph {\n\trankdir=LR\n\t"" [shape=none]\n')
+			for state in included:
+				shape = 'doublecircle' if state in final else 'circle'
+				f.write('\t%s [label=%s shape=%s]\n' % (cls.__quote(state), cls.__quote(node_label(state)), shape))
+			if hidden > 0:
+				f.write('\t"..." [label=%s shape=box style=dashed]\n' % cls.__quote('+%d states' % hidden))
+			if initial_state in shown:
+				f.write('\t"" -> %s\n' % cls.__quote(initial_state))
+			for state in included:
+				edges = {}
+				for char in states[state]:
+					for target in states[state][char]:
+						if target not in shown:
+							target = None
+						edges.setdefault(target, []).append(char)
+				for target in edges:
+					label = cls.__quote(cls.merge_label(edges[target]))
+					if target is None:
+						f.write('\t%s -> "..." [label=%s style=dashed]\n' % (cls.__quote(state), label))
+					else:
+						f.write('\t%s -> %s [label=%s]\n' % (cls.__quote(state), cls.__quote(target), label))
+			f.write('}\n')
+
 class FSM:
 	EPSILON = '$'
 
@@ -224,7 +427,27 @@ class FSM:
 					return True
 			return False
 
+	def compile(self):
+		index = {}
+		for state in self.__states:
+			index[state] = len(index)
+		transitions = []
+		for state in self.__states:
+			row = {}
+			for char in self.__states[state]:
+				if char == FSM.EPSILON or len(self.__states[state][char]) != 1:
+					raise ValueError('FSM is not deterministic')
+				row[char] = index[self.__states[state][char][0]]
+			transitions.append(row)
+		final_states = [index[state] for state in self.__final_states]
+		return CompiledFSM(transitions, index[self.__current_state], final_states)
+
+	def write_dot(self, path, selected=None, hops=None, max_states=None):
+		DotWriter.write(path, self.__states, self.__final_states, self.__current_state, lambda state: state, selected, hops, max_states)
+
 	def get_dot_structure(self):
+		if Digraph is None:
+			raise ImportError('Python library graphviz is required for get_dot_structure')
 		dot = Digraph()
 		dot.format = 'png'
 		dot.attr(rankdir='LR')
@@ -254,16 +477,16 @@ class FSMBuilder:
 		addr = [('@0', tokens, '0', '1')]
 		while len(addr) > 0:
 			current = addr[0]
-			if type(current[1]) == type([]):
+			if type(current[1]) == list:
 				prev = current[2]
 				last_in_seq = current[3]
 				del a._FSM__states[current[2]][current[0]]
 				for i in current[1][:-1]:
 					last_state += 1
 					a.add_state(str(last_state), False)
-					if type(i) == type(LetterToken('')):
+					if type(i) == LetterToken:
 						a.add_transition(str(prev), str(last_state), i.content)
-					elif type(i) == type(GroupToken('')):
+					elif type(i) == GroupToken:
 						addr.append(('@' + str(address), i.content, str(prev), str(last_state)))
 						a.add_transition(str(prev), str(last_state), '@' + str(address))
 						address += 1
@@ -272,9 +495,9 @@ class FSMBuilder:
 						a.add_transition(str(prev), str(last_state), '@' + str(address))
 						address += 1
 					prev = last_state
-				if type(current[1][-1]) == type(LetterToken('')):
+				if type(current[1][-1]) == LetterToken:
 					a.add_transition(str(prev), str(last_in_seq), current[1][-1].content)
-				elif type(current[1][-1]) == type(GroupToken('')):
+				elif type(current[1][-1]) == GroupToken:
 					addr.append(('@' + str(address), current[1][-1].content, str(prev), str(last_in_seq)))
 					a.add_transition(str(prev), str(last_in_seq), '@' + str(address))
 					address += 1
@@ -283,7 +506,7 @@ class FSMBuilder:
 					a.add_transition(str(prev), str(last_in_seq), '@' + str(address))
 					address += 1
 				addr = addr[1:]
-			elif type(current[1]) == type(DisjunctionToken('')):
+			elif type(current[1]) == DisjunctionToken:
 				del a._FSM__states[current[2]][current[0]]
 				from_state = current[2]
 				to_state = current[3]
@@ -292,7 +515,7 @@ class FSMBuilder:
 					a.add_transition(from_state, to_state, '@' + str(address))
 					address += 1
 				addr = addr[1:]
-			elif type(current[1]) == type(IterationToken('')):
+			elif type(current[1]) == IterationToken:
 				del a._FSM__states[current[2]][current[0]]
 				from_state = current[2]
 				to_state = current[3]
@@ -309,7 +532,7 @@ class FSMBuilder:
 		return a
 
 	@classmethod
-	def determinize(cls, fsm):
+	def determinize(cls, fsm, progress=None):
 		def find_key_by_value(d, v):
 			for k in d:
 				if d[k] == v:
@@ -327,9 +550,13 @@ class FSMBuilder:
 				is_final = True
 		determined.add_state(queue[0], is_final)
 		determined.set_initial_state(queue[0])
+		processed = 0
 		while len(queue) > 0:
 			current = queue[0]
 			queue = queue[1:]
+			if progress is not None:
+				progress(processed, new_state_key)
+			processed += 1
 			closure = new_keys[current]
 			chars = fsm.all_possible_chars(closure)
 			if FSM.EPSILON in chars:
@@ -352,13 +579,248 @@ class FSMBuilder:
 		return determined
 
 	@classmethod
-	def build_determined(cls, tokens):
+	def minimize(cls, fsm):
+		states = list(fsm._FSM__states)
+		for state in states:
+			for char in fsm._FSM__states[state]:
+				if char == FSM.EPSILON or len(fsm._FSM__states[state][char]) != 1:
+					raise ValueError('FSM is not deterministic')
+		index = {}
+		for state in states:
+			index[state] = len(index)
+		sink = len(states)
+		alphabet = sorted(set(char for state in states for char in fsm._FSM__states[state]))
+		delta = []
+		inverse = {}
+		for char in alphabet:
+			inverse[char] = [[] for _ in range(sink + 1)]
+		for state in states:
+			row = {}
+			for char in alphabet:
+				if char in fsm._FSM__states[state]:
+					target = index[fsm._FSM__states[state][char][0]]
+				else:
+					target = sink
+				row[char] = target
+				inverse[char][target].append(index[state])
+			delta.append(row)
+		for char in alphabet:
+			inverse[char][sink].append(sink)
+		final = set(index[state] for state in fsm._FSM__final_states)
+		blocks = [set(final), set(range(sink + 1)) - final]
+		blocks = [block for block in blocks if len(block) > 0]
+		block_of = [0] * (sink + 1)
+		for i in range(len(blocks)):
+			for state in blocks[i]:
+				block_of[state] = i
+		waiting = set([min(range(len(blocks)), key=lambda i: len(blocks[i]))])
+		while len(waiting) > 0:
+			splitter = waiting.pop()
+			splitter_states = list(blocks[splitter])
+			for char in alphabet:
+				touched = {}
+				for target in splitter_states:
+					for source in inverse[char][target]:
+						try:
+							touched[block_of[source]].add(source)
+						except KeyError:
+							touched[block_of[source]] = set([source])
+				for block, inside in touched.items():
+					if len(inside) == len(blocks[block]):
+						continue
+					outside = blocks[block] - inside
+					blocks[block] = inside
+					blocks.append(outside)
+					new_block = len(blocks) - 1
+					for state in outside:
+						block_of[state] = new_block
+					if block in waiting or len(outside) < len(inside):
+						waiting.add(new_block)
+					else:
+						waiting.add(block)
+		minimized = FSM()
+		start = block_of[index[fsm._FSM__current_state]]
+		names = { start: '0' }
+		queue = deque([start])
+		minimized.add_state('0', start != block_of[sink] and next(iter(blocks[start])) in final)
+		minimized.set_initial_state('0')
+		while len(queue) > 0:
+			block = queue.popleft()
+			representative = next(iter(blocks[block]))
+			for char in alphabet:
+				target = block_of[delta[representative][char]]
+				if target == block_of[sink]:
+					continue
+				if target not in names:
+					names[target] = str(len(names))
+					queue.append(target)
+					minimized.add_state(names[target], next(iter(blocks[target])) in final)
+				minimized.add_transition(names[block], names[target], char)
+		return minimized
+
+	@classmethod
+	def build_determined(cls, tokens, progress=None):
 		nfa = cls.build(tokens)
 		nfa.get_dot_structure().render('nfa.gv', view=False)
-		dfa = cls.determinize(nfa)
+		dfa = cls.determinize(nfa, progress)
 		dfa.get_dot_structure().render('dfa.gv', view=False)
 		return dfa
 
+class DerivativeMatcher:
+	EMPTY = DisjunctionNode()
+	EPSILON = SequenceNode()
+
+	def __init__(self, node):
+		self.__derivatives = {}
+		self.__nullable = {}
+		self.__alphabet = sorted(self.__letters(node))
+		self.__root = self.normalize(node)
+		self.__transitions = {}
+		self.__states = set([self.__root])
+
+	@classmethod
+	def __letters(cls, node):
+		if type(node) == LetterNode:
+			return set(node.content)
+		result = set()
+		for item in node.content:
+			result |= cls.__letters(item)
+		return result
+
+	@classmethod
+	def concat(cls, items):
+		result = []
+		for item in items:
+			if item is cls.EMPTY:
+				return cls.EMPTY
+			if type(item) == SequenceNode:
+				result += item.content
+			else:
+				result.append(item)
+		if len(result) == 1:
+			return result[0]
+		return SequenceNode(*result)
+
+	@classmethod
+	def union(cls, alternatives):
+		result = set()
+		for item in alternatives:
+			if type(item) == DisjunctionNode:
+				result.update(item.content)
+			else:
+				result.add(item)
+		if len(result) == 1:
+			return result.pop()
+		return DisjunctionNode(*sorted(result, key=lambda item: item.serial))
+
+	@classmethod
+	def star(cls, inner):
+		if type(inner) == IterationNode:
+			return inner
+		if inner is cls.EPSILON or inner is cls.EMPTY:
+			return cls.EPSILON
+		return IterationNode(inner)
+
+	@classmethod
+	def normalize(cls, node):
+		if type(node) == LetterNode:
+			return node
+		elif type(node) == SequenceNode:
+			return cls.concat([cls.normalize(item) for item in node.content])
+		elif type(node) == DisjunctionNode:
+			return cls.union([cls.normalize(item) for item in node.content])
+		elif type(node) == IterationNode:
+			return cls.star(cls.normalize(node.content[0]))
+		raise ValueError('Strong iteration is not supported by DerivativeMatcher')
+
+	def nullable(self, node):
+		try:
+			return self.__nullable[node]
+		except KeyError:
+			pass
+		if type(node) == LetterNode:
+			result = False
+		elif type(node) == SequenceNode:
+			result = all(self.nullable(item) for item in node.content)
+		elif type(node) == DisjunctionNode:
+			result = any(self.nullable(item) for item in node.content)
+		else:
+			result = True
+		self.__nullable[node] = result
+		return result
+
+	def derivative(self, node, char):
+		key = (node, char)
+		try:
+			return self.__derivatives[key]
+		except KeyError:
+			pass
+		if type(node) == LetterNode:
+			result = self.EPSILON if node.content[0] == char else self.EMPTY
+		elif type(node) == SequenceNode:
+			alternatives = []
+			for i in range(len(node.content)):
+				alternatives.append(self.concat((self.derivative(node.content[i], char),) + node.content[i + 1:]))
+				if not self.nullable(node.content[i]):
+					break
+			result = self.union(alternatives)
+		elif type(node) == DisjunctionNode:
+			result = self.union([self.derivative(item, char) for item in node.content])
+		else:
+			result = self.concat([self.derivative(node.content[0], char), node])
+		self.__derivatives[key] = result
+		return result
+
+	def __step(self, node, char):
+		target = self.derivative(node, char)
+		self.__transitions[(node, char)] = target
+		if target is not self.EMPTY:
+			self.__states.add(target)
+		return target
+
+	def state_count(self):
+		return len(self.__states)
+
+	def acceptance(self, s):
+		node = self.__root
+		transitions = self.__transitions
+		for char in s:
+			try:
+				node = transitions[(node, char)]
+			except KeyError:
+				node = self.__step(node, char)
+			if node is self.EMPTY:
+				return False
+		return self.nullable(node)
+
+	def to_fsm(self):
+		fsm = FSM()
+		names = { self.__root: '0' }
+		queue = deque([self.__root])
+		fsm.add_state('0', self.nullable(self.__root))
+		fsm.set_initial_state('0')
+		while len(queue) > 0:
+			node = queue.popleft()
+			for char in self.__alphabet:
+				target = self.__step(node, char)
+				if target is self.EMPTY:
+					continue
+				if target not in names:
+					names[target] = str(len(names))
+					queue.append(target)
+					fsm.add_state(names[target], self.nullable(target))
+				fsm.add_transition(names[node], names[target], char)
+		return fsm
+
+class DerivativeBuilder:
+	@classmethod
+	def build(cls, tokens):
+		return DerivativeMatcher(RegexNode.from_tokens(tokens)).to_fsm()
+
+	@classmethod
+	def build_lazy(cls, tokens):
+		return DerivativeMatcher(RegexNode.from_tokens(tokens))
+
 class MooreMachine:
 	EPSILON = '$'
 
@@ -472,7 +934,29 @@ class MooreMachine:
 				self.__current_state = prev_state
 				return result
 
+	def compile(self):
+		index = {}
+		for state in self.__states:
+			index[state] = len(index)
+		transitions = []
+		returns = []
+		for state in self.__states:
+			row = {}
+			for char in self.__states[state]:
+				if char == MooreMachine.EPSILON or len(self.__states[state][char]) != 1:
+					raise ValueError('MooreMachine is not deterministic')
+				row[char] = index[self.__states[state][char][0]]
+			transitions.append(row)
+			returns.append(self.__returns[state])
+		final_states = [index[state] for state in self.__final_states]
+		return CompiledMooreMachine(transitions, index[self.__current_state], final_states, returns)
+
+	def write_dot(self, path, selected=None, hops=None, max_states=None):
+		DotWriter.write(path, self.__states, self.__final_states, self.__current_state, lambda state: state + ' - ' + str(self.__returns[state]), selected, hops, max_states)
+
 	def get_dot_structure(self):
+		if Digraph is None:
+			raise ImportError('Python library graphviz is required for get_dot_structure')
 		dot = Digraph()
 		dot.format = 'png'
 		dot.attr(rankdir='LR')
@@ -505,16 +989,16 @@ class MooreMachineBuilder:
 		address = len(addr)
 		while len(addr) > 0:
 			current = addr[0]
-			if type(current[1]) == type([]):
+			if type(current[1]) == list:
 				prev = current[2]
 				last_in_seq = current[3]
 				del a._MooreMachine__states[current[2]][current[0]]
 				for i in current[1][:-1]:
 					last_state += 1
 					a.add_state(str(last_state), None, False)
-					if type(i) == type(LetterToken('')):
+					if type(i) == LetterToken:
 						a.add_transition(str(prev), str(last_state), i.content)
-					elif type(i) == type(GroupToken('')):
+					elif type(i) == GroupToken:
 						addr.append(('@' + str(address), i.content, str(prev), str(last_state)))
 						a.add_transition(str(prev), str(last_state), '@' + str(address))
 						address += 1
@@ -523,9 +1007,9 @@ class MooreMachineBuilder:
 						a.add_transition(str(prev), str(last_state), '@' + str(address))
 						address += 1
 					prev = last_state
-				if type(current[1][-1]) == type(LetterToken('')):
+				if type(current[1][-1]) == LetterToken:
 					a.add_transition(str(prev), str(last_in_seq), current[1][-1].content)
-				elif type(current[1][-1]) == type(GroupToken('')):
+				elif type(current[1][-1]) == GroupToken:
 					addr.append(('@' + str(address), current[1][-1].content, str(prev), str(last_in_seq)))
 					a.add_transition(str(prev), str(last_in_seq), '@' + str(address))
 					address += 1
@@ -534,7 +1018,7 @@ class MooreMachineBuilder:
 					a.add_transition(str(prev), str(last_in_seq), '@' + str(address))
 					address += 1
 				addr = addr[1:]
-			elif type(current[1]) == type(DisjunctionToken('')):
+			elif type(current[1]) == DisjunctionToken:
 				del a._MooreMachine__states[current[2]][current[0]]
 				from_state = current[2]
 				to_state = current[3]
@@ -543,7 +1027,7 @@ class MooreMachineBuilder:
 					a.add_transition(from_state, to_state, '@' + str(address))
 					address += 1
 				addr = addr[1:]
-			elif type(current[1]) == type(IterationToken('')):
+			elif type(current[1]) == IterationToken:
 				del a._MooreMachine__states[current[2]][current[0]]
 				from_state = current[2]
 				to_state = current[3]
@@ -560,7 +1044,7 @@ class MooreMachineBuilder:
 		return a
 
 	@classmethod
-	def determinize(cls, moore_machine):
+	def determinize(cls, moore_machine, progress=None):
 		def find_key_by_value(d, v):
 			for k in d:
 				if d[k] == v:
@@ -583,9 +1067,13 @@ class MooreMachineBuilder:
 					mark.append(moore_machine._MooreMachine__returns[item])
 		determined.add_state(queue[0], mark, is_final)
 		determined.set_initial_state(queue[0])
+		processed = 0
 		while len(queue) > 0:
 			current = queue[0]
 			queue = queue[1:]
+			if progress is not None:
+				progress(processed, new_state_key)
+			processed += 1
 			closure = new_keys[current]
 			chars = moore_machine.all_possible_chars(closure)
 			if MooreMachine.EPSILON in chars:
@@ -613,13 +1101,320 @@ class MooreMachineBuilder:
 		return determined
 
 	@classmethod
-	def build_moore(cls, tokens_lists):
+	def build_moore(cls, tokens_lists, progress=None):
 		nfa = cls.build(tokens_lists)
 		nfa.get_dot_structure().render('nfa.gv', view=False)
-		dfa = cls.determinize(nfa)
+		dfa = cls.determinize(nfa, progress)
 		dfa.get_dot_structure().render('dfa.gv', view=False)
 		return dfa
 
+class MoorePatternSet:
+	__fragments = weakref.WeakKeyDictionary()
+
+	def __init__(self, tokens_lists=None):
+		self.__patterns = {}
+		self.__positions = {}
+		self.__next_position = 0
+		self.__next_label = 1
+		self.__names = {}
+		self.__subsets = {}
+		self.__involving = {}
+		self.__incomplete = deque()
+		self.__dirty = set()
+		self.__ready = False
+		self.__machine = MooreMachine()
+		self.__start = None
+		self.__next_name = 0
+		self.__churn = 0
+		if tokens_lists is not None:
+			for tokens in tokens_lists:
+				self.add_pattern(tokens)
+
+	@classmethod
+	def __fragment(cls, tokens):
+		node = RegexNode.from_tokens(tokens)
+		fragment = cls.__fragments.get(node)
+		if fragment is None:
+			fragment = cls.__build_fragment(tokens)
+			cls.__fragments[node] = fragment
+		return fragment + (node,)
+
+	@classmethod
+	def __build_fragment(cls, tokens):
+		nfa = MooreMachineBuilder.build([tokens])
+		states = nfa._MooreMachine__states
+		closures = {}
+		for state in states:
+			closure = set([state])
+			stack = [state]
+			while len(stack) > 0:
+				for target in states[stack.pop()].get(MooreMachine.EPSILON, []):
+					if target not in closure:
+						closure.add(target)
+						stack.append(target)
+			closures[state] = closure
+		transitions = {}
+		for state in states:
+			transitions[state] = {}
+			for char in states[state]:
+				if char != MooreMachine.EPSILON:
+					targets = set()
+					for target in states[state][char]:
+						targets |= closures[target]
+					transitions[state][char] = frozenset(targets)
+		return frozenset(closures[nfa._MooreMachine__current_state]), transitions, frozenset(nfa._MooreMachine__final_states)
+
+	def __changed(self, label):
+		self.__dirty.add(label)
+		self.__ready = False
+
+	def add_pattern(self, tokens, label=None):
+		if label is None:
+			label = 'R' + str(self.__next_label)
+			self.__next_label += 1
+		if label in self.__patterns:
+			raise ValueError('Pattern is already exist in MoorePatternSet')
+		self.__patterns[label] = self.__fragment(tokens)
+		self.__positions[label] = self.__next_position
+		self.__next_position += 1
+		self.__changed(label)
+		return label
+
+	def remove_pattern(self, label):
+		if label not in self.__patterns:
+			raise ValueError('Pattern does not exist in MoorePatternSet')
+		del self.__patterns[label]
+		del self.__positions[label]
+		self.__changed(label)
+
+	def replace_pattern(self, label, tokens):
+		if label not in self.__patterns:
+			raise ValueError('Pattern does not exist in MoorePatternSet')
+		self.__patterns[label] = self.__fragment(tokens)
+		self.__changed(label)
+
+	def labels(self):
+		return list(self.__patterns)
+
+	def __transitions(self, subset):
+		result = {}
+		for label, state in subset:
+			for char, targets in self.__patterns[label][1][state].items():
+				result.setdefault(char, set()).update((label, target) for target in targets)
+		for char in result:
+			result[char] = frozenset(result[char])
+		return result
+
+	def __add_state(self, subset):
+		name = str(self.__next_name)
+		self.__next_name += 1
+		self.__names[subset] = name
+		self.__subsets[name] = subset
+		labels = set()
+		for label, state in subset:
+			if state in self.__patterns[label][2]:
+				labels.add(label)
+			self.__involving.setdefault(label, set()).add(subset)
+		returns = sorted(labels, key=self.__positions.get) if len(labels) > 0 else None
+		self.__machine.add_state(name, returns, returns is not None)
+		self.__incomplete.append(subset)
+		self.__churn += 1
+
+	def __remove_states(self, names):
+		states = self.__machine._MooreMachine__states
+		returns = self.__machine._MooreMachine__returns
+		for name in names:
+			subset = self.__subsets.pop(name)
+			del self.__names[subset]
+			for label in set(label for label, state in subset):
+				if label in self.__involving:
+					self.__involving[label].discard(subset)
+			del states[name]
+			del returns[name]
+		self.__machine._MooreMachine__final_states = [state for state in self.__machine._MooreMachine__final_states if state in states]
+		self.__incomplete = deque(subset for subset in self.__incomplete if subset in self.__names)
+
+	def __sweep(self):
+		states = self.__machine._MooreMachine__states
+		reachable = set([self.__names[self.__start]])
+		reachable.update(self.__names[subset] for subset in self.__incomplete)
+		queue = deque(reachable)
+		while len(queue) > 0:
+			for targets in states[queue.popleft()].values():
+				for target in targets:
+					if target not in reachable:
+						reachable.add(target)
+						queue.append(target)
+		self.__remove_states([name for name in states if name not in reachable])
+		self.__churn = 0
+
+	def __update(self, max_states):
+		initial = len(self.__names) == 0
+		removed = set()
+		for label in self.__dirty:
+			removed.update(self.__names[subset] for subset in self.__involving.pop(label, ()))
+		self.__dirty = set()
+		if len(removed) > 0:
+			self.__remove_states(removed)
+		self.__start = frozenset((label, state) for label in self.__patterns for state in self.__patterns[label][0])
+		if self.__start not in self.__names:
+			self.__add_state(self.__start)
+		self.__machine.set_initial_state(self.__names[self.__start])
+		if max_states is not None and self.__churn > 0:
+			self.__sweep()
+		while len(self.__incomplete) > 0:
+			subset = self.__incomplete[0]
+			transitions = self.__transitions(subset)
+			chars = sorted(transitions)
+			for char in chars:
+				target = transitions[char]
+				if target not in self.__names:
+					if max_states is not None and len(self.__names) >= max_states:
+						raise ValueError('MoorePatternSet exceeds %d states' % max_states)
+					self.__add_state(target)
+			for char in chars:
+				self.__machine.add_transition(self.__names[subset], self.__names[transitions[char]], char)
+			self.__incomplete.popleft()
+		if initial:
+			self.__churn = 0
+		elif self.__churn > len(self.__names):
+			self.__sweep()
+		self.__ready = True
+
+	def get_machine(self, max_states=None):
+		if not self.__ready:
+			self.__update(max_states)
+		elif max_states is not None and len(self.__names) > max_states:
+			self.__sweep()
+			if len(self.__names) > max_states:
+				raise ValueError('MoorePatternSet exceeds %d states' % max_states)
+		return self.__machine
+
+class Scanner:
+	CHUNK_SIZE = 65536
+
+	def __init__(self, machine, priorities=None):
+		if not isinstance(machine, CompiledMooreMachine):
+			machine = machine.compile()
+		self.__machine = machine
+
+		def priority(label):
+			if priorities is not None:
+				if label in priorities:
+					return (0, priorities.index(label), '')
+				return (1, 0, label)
+			if label[:1] == 'R' and label[1:].isdigit():
+				return (0, int(label[1:]), '')
+			return (1, 0, label)
+
+		self.__labels = tuple(None if returns is None else min(returns, key=priority) for returns in machine.returns)
+
+	@classmethod
+	def build(cls, tokens_lists, priorities=None):
+		return cls(MooreMachineBuilder.determinize(MooreMachineBuilder.build(tokens_lists)), priorities)
+
+	def scan(self, stream):
+		if isinstance(stream, str):
+			chunks = iter([stream])
+		elif hasattr(stream, 'read'):
+			chunks = iter(lambda: stream.read(self.CHUNK_SIZE), '')
+		else:
+			chunks = iter(stream)
+		transitions = self.__machine.transitions
+		labels = self.__labels
+		initial_state = self.__machine.initial_state
+		buffer = ''
+		base = 0
+		start = 0
+		pos = 0
+		state = initial_state
+		last_label = None
+		last_end = 0
+		exhausted = False
+		while True:
+			if pos == len(buffer):
+				if not exhausted:
+					chunk = next(chunks, None)
+					if chunk is None:
+						exhausted = True
+					else:
+						buffer = buffer[start:] + chunk
+						base += start
+						pos -= start
+						last_end -= start
+						start = 0
+					continue
+				if start == len(buffer):
+					return
+				target = None
+			else:
+				target = transitions[state].get(buffer[pos])
+			if target is not None:
+				state = target
+				pos += 1
+				if labels[state] is not None:
+					last_label = labels[state]
+					last_end = pos
+				continue
+			if last_end == start:
+				last_label = None
+				last_end = start + 1
+			yield (last_label, base + start, base + last_end)
+			start = last_end
+			pos = start
+			state = initial_state
+			last_label = None
+
+class MoorePartitioner:
+	@classmethod
+	def partition(cls, tokens_lists, max_states):
+		patterns = []
+		for i in range(len(tokens_lists)):
+			single = MoorePatternSet()
+			single.add_pattern(tokens_lists[i], 'R' + str(i + 1))
+			size = len(single.get_machine()._MooreMachine__states)
+			if size > max_states:
+				raise ValueError('Pattern R%d alone exceeds %d states' % (i + 1, max_states))
+			patterns.append((size, i))
+		shards = []
+		for size, i in sorted(patterns, key=lambda item: (-item[0], item[1])):
+			label = 'R' + str(i + 1)
+			for shard in shards:
+				shard.add_pattern(tokens_lists[i], label)
+				try:
+					shard.get_machine(max_states)
+					break
+				except ValueError:
+					shard.remove_pattern(label)
+			else:
+				shard = MoorePatternSet()
+				shard.add_pattern(tokens_lists[i], label)
+				shards.append(shard)
+		return ShardedMooreMatcher([shard.get_machine() for shard in shards])
+
+class ShardedMooreMatcher:
+	def __init__(self, machines):
+		self.shards = tuple(machine if isinstance(machine, CompiledMooreMachine) else machine.compile() for machine in machines)
+
+	def acceptance(self, s):
+		active = [(shard.transitions, shard.initial_state, shard.returns) for shard in self.shards]
+		for char in s:
+			moved = []
+			for transitions, state, returns in active:
+				state = transitions[state].get(char)
+				if state is not None:
+					moved.append((transitions, state, returns))
+			active = moved
+			if len(active) == 0:
+				return None
+		labels = []
+		for transitions, state, returns in active:
+			if returns[state] is not None:
+				labels += returns[state]
+		if len(labels) == 0:
+			return None
+		return tuple(sorted(labels))
+
 class BuchiMachine:
 	EPSILON = '$'
 
@@ -754,7 +1549,29 @@ class BuchiMachine:
 				self.__current_state = prev_state
 				return result
 
+	def compile(self):
+		index = {}
+		for state in self.__states:
+			index[state] = len(index)
+		transitions = []
+		returns = []
+		for state in self.__states:
+			row = {}
+			for char in self.__states[state]:
+				if char == BuchiMachine.EPSILON or len(self.__states[state][char]) != 1:
+					raise ValueError('BuchiMachine is not deterministic')
+				row[char] = index[self.__states[state][char][0]]
+			transitions.append(row)
+			returns.append(self.__returns[state])
+		final_states = [index[state] for state in self.__final_states]
+		return CompiledMooreMachine(transitions, index[self.__current_state], final_states, returns)
+
+	def write_dot(self, path, selected=None, hops=None, max_states=None):
+		DotWriter.write(path, self.__states, self.__final_states, self.__current_state, lambda state: state, selected, hops, max_states)
+
 	def get_dot_structure(self):
+		if Digraph is None:
+			raise ImportError('Python library graphviz is required for get_dot_structure')
 		dot = Digraph()
 		dot.format = 'png'
 		dot.attr(rankdir='LR')
@@ -787,16 +1604,16 @@ class BuchiMachineBuilder:
 		address = len(addr)
 		while len(addr) > 0:
 			current = addr[0]
-			if type(current[1]) == type([]):
+			if type(current[1]) == list:
 				prev = current[2]
 				last_in_seq = current[3]
 				del a._BuchiMachine__states[current[2]][current[0]]
 				for i in current[1][:-1]:
 					last_state += 1
 					a.add_state(str(last_state), None, False)
-					if type(i) == type(LetterToken('')):
+					if type(i) == LetterToken:
 						a.add_transition(str(prev), str(last_state), i.content)
-					elif type(i) == type(GroupToken('')):
+					elif type(i) == GroupToken:
 						addr.append(('@' + str(address), i.content, str(prev), str(last_state)))
 						a.add_transition(str(prev), str(last_state), '@' + str(address))
 						address += 1
@@ -805,9 +1622,9 @@ class BuchiMachineBuilder:
 						a.add_transition(str(prev), str(last_state), '@' + str(address))
 						address += 1
 					prev = last_state
-				if type(current[1][-1]) == type(LetterToken('')):
+				if type(current[1][-1]) == LetterToken:
 					a.add_transition(str(prev), str(last_in_seq), current[1][-1].content)
-				elif type(current[1][-1]) == type(GroupToken('')):
+				elif type(current[1][-1]) == GroupToken:
 					addr.append(('@' + str(address), current[1][-1].content, str(prev), str(last_in_seq)))
 					a.add_transition(str(prev), str(last_in_seq), '@' + str(address))
 					address += 1
@@ -816,7 +1633,7 @@ class BuchiMachineBuilder:
 					a.add_transition(str(prev), str(last_in_seq), '@' + str(address))
 					address += 1
 				addr = addr[1:]
-			elif type(current[1]) == type(DisjunctionToken('')):
+			elif type(current[1]) == DisjunctionToken:
 				del a._BuchiMachine__states[current[2]][current[0]]
 				from_state = current[2]
 				to_state = current[3]
@@ -825,7 +1642,7 @@ class BuchiMachineBuilder:
 					a.add_transition(from_state, to_state, '@' + str(address))
 					address += 1
 				addr = addr[1:]
-			elif type(current[1]) == type(IterationToken('')):
+			elif type(current[1]) == IterationToken:
 				del a._BuchiMachine__states[current[2]][current[0]]
 				from_state = current[2]
 				to_state = current[3]
@@ -837,7 +1654,7 @@ class BuchiMachineBuilder:
 				a.add_transition(str(last_state), str(last_state), '@' + str(address))
 				address += 1
 				addr = addr[1:]
-			elif type(current[1]) == type(StrongIterationToken('')):
+			elif type(current[1]) == StrongIterationToken:
 				del a._BuchiMachine__states[current[2]][current[0]]
 				from_state = current[2]
 				to_state = current[3]
@@ -851,7 +1668,7 @@ class BuchiMachineBuilder:
 		return a
 
 	@classmethod
-	def determinize(cls, buchi_machine):
+	def determinize(cls, buchi_machine, progress=None):
 		def find_key_by_value(d, v):
 			for k in d:
 				if d[k] == v:
@@ -874,9 +1691,13 @@ class BuchiMachineBuilder:
 					mark.append(buchi_machine._BuchiMachine__returns[item])
 		determined.add_state(queue[0], mark, is_final)
 		determined.set_initial_state(queue[0])
+		processed = 0
 		while len(queue) > 0:
 			current = queue[0]
 			queue = queue[1:]
+			if progress is not None:
+				progress(processed, new_state_key)
+			processed += 1
 			closure = new_keys[current]
 			chars = buchi_machine.all_possible_chars(closure)
 			if BuchiMachine.EPSILON in chars:
@@ -904,11 +1725,767 @@ class BuchiMachineBuilder:
 		return determined
 
 	@classmethod
-	def build_buchi(cls, tokens_lists):
+	def build_buchi(cls, tokens_lists, progress=None):
 		nfa = cls.build(tokens_lists)
 		print(nfa._BuchiMachine__states)
 		nfa.get_dot_structure().render('nfa.gv', view=False)
-		dfa = cls.determinize(nfa)
+		dfa = cls.determinize(nfa, progress)
 		dfa.get_dot_structure().render('dfa.gv', view=False)
 		return dfa
 
+class CompiledMachine:
+	__slots__ = ('transitions', 'initial_state', 'final_states')
+
+	def __init__(self, transitions, initial_state, final_states):
+		object.__setattr__(self, 'transitions', tuple(MappingProxyType(dict(row)) for row in transitions))
+		object.__setattr__(self, 'initial_state', initial_state)
+		object.__setattr__(self, 'final_states', frozenset(final_states))
+
+	def __setattr__(self, name, value):
+		raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+	def __delattr__(self, name):
+		raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+	def __reduce__(self):
+		return (self.__class__, ([dict(row) for row in self.transitions], self.initial_state, sorted(self.final_states)))
+
+	def run(self, s, state=None):
+		if state is None:
+			state = self.initial_state
+		transitions = self.transitions
+		for char in s:
+			state = transitions[state].get(char)
+			if state is None:
+				return None
+		return state
+
+	def output(self, state):
+		raise NotImplementedError('Method output is not implemented in CompiledMachine class')
+
+	def acceptance(self, s):
+		return self.output(self.run(s))
+
+	def cursor(self):
+		return MatchCursor(self)
+
+	def renumber(self, order):
+		order = list(order)
+		placed = set(order)
+		if len(placed) != len(order) or not placed <= set(range(len(self.transitions))):
+			raise ValueError('Order is not a permutation of states')
+		order += [state for state in range(len(self.transitions)) if state not in placed]
+		index = [0] * len(order)
+		for i in range(len(order)):
+			index[order[i]] = i
+		transitions = [dict((char, index[target]) for char, target in self.transitions[state].items()) for state in order]
+		args = self.__reduce__()[1]
+		return self.__class__(transitions, index[self.initial_state], [index[state] for state in self.final_states], *[[item[state] for state in order] for item in args[3:]])
+
+	def map(self, words, workers=None, chunk_size=1024):
+		def chunks():
+			chunk = []
+			for word in words:
+				chunk.append(word)
+				if len(chunk) == chunk_size:
+					yield chunk
+					chunk = []
+			if len(chunk) > 0:
+				yield chunk
+
+		def match_chunk(chunk):
+			return [self.acceptance(word) for word in chunk]
+
+		result = []
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			for chunk_result in executor.map(match_chunk, chunks()):
+				result += chunk_result
+		return result
+
+class CompiledFSM(CompiledMachine):
+	__slots__ = ()
+
+	def output(self, state):
+		return state is not None and state in self.final_states
+
+class CompiledMooreMachine(CompiledMachine):
+	__slots__ = ('returns',)
+
+	def __init__(self, transitions, initial_state, final_states, returns):
+		CompiledMachine.__init__(self, transitions, initial_state, final_states)
+		object.__setattr__(self, 'returns', tuple(None if item is None else tuple(item) for item in returns))
+
+	def __reduce__(self):
+		return (self.__class__, ([dict(row) for row in self.transitions], self.initial_state, sorted(self.final_states), list(self.returns)))
+
+	def output(self, state):
+		if state is None:
+			return None
+		return self.returns[state]
+
+class MachineProfile:
+	def __init__(self, machine):
+		if not isinstance(machine, CompiledMachine):
+			machine = machine.compile()
+		self.machine = machine
+		self.state_counts = [0] * len(machine.transitions)
+		self.transition_counts = {}
+
+	def collect(self, words):
+		transitions = self.machine.transitions
+		state_counts = self.state_counts
+		transition_counts = self.transition_counts
+		for word in words:
+			state = self.machine.initial_state
+			state_counts[state] += 1
+			for char in word:
+				target = transitions[state].get(char)
+				if target is None:
+					break
+				key = (state, char)
+				transition_counts[key] = transition_counts.get(key, 0) + 1
+				state = target
+				state_counts[state] += 1
+		return self
+
+	def hot_order(self):
+		transitions = self.machine.transitions
+		hottest = {}
+		for (state, char), count in self.transition_counts.items():
+			if state not in hottest or count > hottest[state][0]:
+				hottest[state] = (count, transitions[state][char])
+		order = []
+		placed = set()
+		visited = sorted((state for state in range(len(transitions)) if self.state_counts[state] > 0 and state != self.machine.initial_state), key=lambda state: (-self.state_counts[state], state))
+		visited.insert(0, self.machine.initial_state)
+		for state in visited:
+			while state is not None and state not in placed:
+				order.append(state)
+				placed.add(state)
+				state = hottest[state][1] if state in hottest else None
+		queue = deque(order)
+		while len(queue) > 0:
+			state = queue.popleft()
+			for char in sorted(transitions[state]):
+				target = transitions[state][char]
+				if target not in placed:
+					order.append(target)
+					placed.add(target)
+					queue.append(target)
+		return order
+
+	def hot_states(self):
+		return sum(1 for count in self.state_counts if count > 0)
+
+	def optimize(self, compress=False):
+		order = self.hot_order()
+		machine = self.machine.renumber(order)
+		if compress:
+			return CompactMachine(machine, self.hot_states())
+		return machine
+
+class CompactMachine:
+	__slots__ = ('alphabet', 'initial_state', 'final_states', 'returns', 'hot_states', 'dense', 'base', 'next', 'check')
+
+	def __init__(self, machine, hot_states=None):
+		if not isinstance(machine, CompiledMachine):
+			machine = machine.compile()
+		if hot_states is None:
+			hot_states = len(machine.transitions)
+		chars = {}
+		for row in machine.transitions:
+			for char in row:
+				chars[char] = chars.get(char, 0) + 1
+		alphabet = {}
+		for char in sorted(chars, key=lambda char: (-chars[char], char)):
+			alphabet[char] = len(alphabet)
+		width = len(alphabet)
+		dense = array.array('i', [-1] * (hot_states * width))
+		for state in range(hot_states):
+			for char, target in machine.transitions[state].items():
+				dense[state * width + alphabet[char]] = target
+		base = array.array('i', [0] * (len(machine.transitions) - hot_states))
+		next_state = array.array('i')
+		check = array.array('i')
+		rows = sorted(range(hot_states, len(machine.transitions)), key=lambda state: -len(machine.transitions[state]))
+		for state in rows:
+			columns = [alphabet[char] for char in machine.transitions[state]]
+			offset = 0
+			while any(offset + column < len(check) and check[offset + column] != -1 for column in columns):
+				offset += 1
+			for column in columns:
+				while offset + column >= len(check):
+					check.append(-1)
+					next_state.append(-1)
+			for char, target in machine.transitions[state].items():
+				check[offset + alphabet[char]] = state
+				next_state[offset + alphabet[char]] = target
+			base[state - hot_states] = offset
+		object.__setattr__(self, 'alphabet', MappingProxyType(alphabet))
+		object.__setattr__(self, 'initial_state', machine.initial_state)
+		object.__setattr__(self, 'final_states', machine.final_states)
+		object.__setattr__(self, 'returns', getattr(machine, 'returns', None))
+		object.__setattr__(self, 'hot_states', hot_states)
+		object.__setattr__(self, 'dense', dense)
+		object.__setattr__(self, 'base', base)
+		object.__setattr__(self, 'next', next_state)
+		object.__setattr__(self, 'check', check)
+
+	def __setattr__(self, name, value):
+		raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+	def __delattr__(self, name):
+		raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+	def run(self, s, state=None):
+		if state is None:
+			state = self.initial_state
+		alphabet = self.alphabet
+		hot_states = self.hot_states
+		width = len(alphabet)
+		dense = self.dense
+		base = self.base
+		next_state = self.next
+		check = self.check
+		for char in s:
+			column = alphabet.get(char)
+			if column is None:
+				return None
+			if state < hot_states:
+				state = dense[state * width + column]
+				if state < 0:
+					return None
+			else:
+				position = base[state - hot_states] + column
+				if position >= len(check) or check[position] != state:
+					return None
+				state = next_state[position]
+		return state
+
+	def output(self, state):
+		if self.returns is not None:
+			if state is None:
+				return None
+			return self.returns[state]
+		return state is not None and state in self.final_states
+
+	def acceptance(self, s):
+		return self.output(self.run(s))
+
+class ParallelScanner:
+	CHUNK_SIZE = 16 * 1024 * 1024
+	FIRST_BLOCK = 4096
+	BLOCK_ENTRIES = 4 * 1024 * 1024
+	table = None
+	byte_maps = None
+	pair_maps = None
+
+	def __init__(self, machine):
+		if not isinstance(machine, CompiledMachine):
+			machine = machine.compile()
+		self.__machine = machine
+		dead = len(machine.transitions)
+		self.__table = []
+		for row in machine.transitions:
+			table_row = [dead] * 256
+			for char, target in row.items():
+				if ord(char) < 256:
+					table_row[ord(char)] = target
+			self.__table.append(table_row)
+		self.__table.append([dead] * 256)
+
+	@classmethod
+	def init_worker(cls, table):
+		import numpy
+
+		cls.table = numpy.array(table, dtype=numpy.int32)
+		size = cls.table.shape[0]
+		if size <= 256:
+			dtype = numpy.uint8
+		elif size <= 65536:
+			dtype = numpy.uint16
+		else:
+			dtype = numpy.int32
+		cls.byte_maps = numpy.ascontiguousarray(cls.table.T.astype(dtype))
+		cls.pair_maps = None
+		if 65536 * size <= cls.BLOCK_ENTRIES:
+			maps = cls.byte_maps
+			cls.pair_maps = numpy.take_along_axis(numpy.broadcast_to(maps[None, :, :], (256, 256, size)), numpy.broadcast_to(maps[:, None, :], (256, 256, size)), axis=2)
+
+	@classmethod
+	def block_mapping(cls, block):
+		import numpy
+
+		size = cls.byte_maps.shape[1]
+		if cls.pair_maps is not None and len(block) > 1:
+			maps = cls.pair_maps[block[0:len(block) - 1:2], block[1::2]]
+			if len(block) % 2 == 1:
+				maps = numpy.concatenate([maps, cls.byte_maps[block[-1:]]])
+		else:
+			maps = cls.byte_maps[block]
+		while len(maps) > 1:
+			if len(maps) % 2 == 1:
+				maps = numpy.concatenate([maps, numpy.arange(size, dtype=maps.dtype)[None, :]])
+			second = maps[1::2]
+			offsets = numpy.arange(len(second), dtype=numpy.int64)[:, None] * size
+			maps = numpy.take(second.reshape(-1), (maps[0::2] + offsets).reshape(-1)).reshape(len(second), size)
+		return maps[0].astype(numpy.int32)
+
+	@classmethod
+	def chunk_mapping(cls, path, offset, length):
+		import numpy
+
+		table = cls.table
+		dead = table.shape[0] - 1
+		block_size = max(1, cls.BLOCK_ENTRIES // table.shape[0])
+		mapping = numpy.arange(table.shape[0], dtype=numpy.int32)
+		with open(path, 'rb') as f:
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+				data = numpy.frombuffer(mm, dtype=numpy.uint8, count=length, offset=offset)
+				pos = 0
+				end = min(cls.FIRST_BLOCK, length)
+				live = numpy.unique(mapping[mapping != dead])
+				while pos < length and len(live) > 1:
+					mapping = cls.block_mapping(data[pos:end])[mapping]
+					pos = end
+					end = min(pos + block_size, length)
+					live = numpy.unique(mapping[mapping != dead])
+				del data
+				mapping = mapping.tolist()
+				if pos < length and len(live) == 1:
+					rows = table.tolist()
+					state = int(live[0])
+					for byte in mm[offset + pos:offset + length]:
+						state = rows[state][byte]
+						if state == dead:
+							break
+					mapping = [state if item != dead else dead for item in mapping]
+		return mapping
+
+	def run(self, path, workers=None, chunk_size=None):
+		if chunk_size is None:
+			chunk_size = self.CHUNK_SIZE
+		size = os.path.getsize(path)
+		state = self.__machine.initial_state
+		dead = len(self.__machine.transitions)
+		with ProcessPoolExecutor(max_workers=workers, initializer=ParallelScanner.init_worker, initargs=(self.__table,)) as executor:
+			futures = [executor.submit(ParallelScanner.chunk_mapping, path, offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)]
+			for future in futures:
+				state = future.result()[state]
+		if state == dead:
+			return None
+		return state
+
+	def acceptance(self, path, workers=None, chunk_size=None):
+		return self.__machine.output(self.run(path, workers, chunk_size))
+
+class MatchCursor:
+	__slots__ = ('machine', 'state')
+
+	def __init__(self, machine):
+		self.machine = machine
+		self.state = machine.initial_state
+
+	def reset(self):
+		self.state = self.machine.initial_state
+		return self
+
+	def feed(self, s):
+		if self.state is not None:
+			self.state = self.machine.run(s, self.state)
+		return self
+
+	def is_dead(self):
+		return self.state is None
+
+	def result(self):
+		return self.machine.output(self.state)
+
+class MachineOperations:
+	@classmethod
+	def __is_deterministic(cls, states):
+		for state in states:
+			for char in states[state]:
+				if char == FSM.EPSILON or len(states[state][char]) != 1:
+					return False
+		return True
+
+	@classmethod
+	def __check_deterministic(cls, fsm):
+		if not cls.__is_deterministic(fsm._FSM__states):
+			raise ValueError('FSM is not deterministic')
+
+	@classmethod
+	def __step(cls, fsm, state, char):
+		if state is None:
+			return None
+		try:
+			return fsm._FSM__states[state][char][0]
+		except KeyError:
+			return None
+
+	@classmethod
+	def __alphabet(cls, fsm):
+		return set(char for state in fsm._FSM__states for char in fsm._FSM__states[state])
+
+	@classmethod
+	def __deterministic_view(cls, machine):
+		if isinstance(machine, FSM):
+			if not cls.__is_deterministic(machine._FSM__states):
+				machine = FSMBuilder.determinize(machine)
+			final = set(machine._FSM__final_states)
+			return machine._FSM__states, machine._FSM__current_state, lambda state: state is not None and state in final
+		elif isinstance(machine, MooreMachine):
+			if not cls.__is_deterministic(machine._MooreMachine__states):
+				machine = MooreMachineBuilder.determinize(machine)
+			returns = machine._MooreMachine__returns
+			return machine._MooreMachine__states, machine._MooreMachine__current_state, lambda state: frozenset() if state is None or returns[state] is None else frozenset(returns[state])
+		raise ValueError('Machine type is not supported')
+
+	@classmethod
+	def __shortest_witness(cls, a, b, is_witness):
+		a_states, a_start, a_output = a
+		b_states, b_start, b_output = b
+		alphabet = sorted(set(char for state in a_states for char in a_states[state]) | set(char for state in b_states for char in b_states[state]))
+		start = (a_start, b_start)
+		parents = { start: None }
+		queue = deque([start])
+		while len(queue) > 0:
+			pair = queue.popleft()
+			if is_witness(a_output(pair[0]), b_output(pair[1])):
+				word = []
+				while parents[pair] is not None:
+					pair, char = parents[pair]
+					word.append(char)
+				return ''.join(reversed(word))
+			for char in alphabet:
+				target = (a_states[pair[0]][char][0] if pair[0] is not None and char in a_states[pair[0]] else None,
+					b_states[pair[1]][char][0] if pair[1] is not None and char in b_states[pair[1]] else None)
+				if target != (None, None) and target not in parents:
+					parents[target] = (pair, char)
+					queue.append(target)
+		return None
+
+	@classmethod
+	def __closure(cls, states, indices, cache):
+		key = frozenset(indices)
+		if key in cache:
+			return cache[key]
+		result = set(indices)
+		stack = list(indices)
+		while len(stack) > 0:
+			for target in states[stack.pop()].get(FSM.EPSILON, []):
+				if target not in result:
+					result.add(target)
+					stack.append(target)
+		result = frozenset(result)
+		cache[key] = result
+		return result
+
+	@classmethod
+	def equivalent(cls, a, b):
+		if type(a) != type(b):
+			raise ValueError('Machines have different types')
+		a = cls.__deterministic_view(a)
+		b = cls.__deterministic_view(b)
+		a_states, a_start, a_output = a
+		b_states, b_start, b_output = b
+		alphabet = sorted(set(char for state in a_states for char in a_states[state]) | set(char for state in b_states for char in b_states[state]))
+		parent = {}
+
+		def find(node):
+			root = node
+			while root in parent:
+				root = parent[root]
+			while node != root:
+				parent[node], node = root, parent[node]
+			return root
+
+		parent[(1, b_start)] = (0, a_start)
+		queue = deque([(a_start, b_start)])
+		while len(queue) > 0:
+			p, q = queue.popleft()
+			if a_output(p) != b_output(q):
+				return False, cls.__shortest_witness(a, b, lambda x, y: x != y)
+			for char in alphabet:
+				p_next = a_states[p][char][0] if p is not None and char in a_states[p] else None
+				q_next = b_states[q][char][0] if q is not None and char in b_states[q] else None
+				p_root = find((0, p_next))
+				q_root = find((1, q_next))
+				if p_root != q_root:
+					parent[q_root] = p_root
+					queue.append((p_next, q_next))
+		return True, None
+
+	@classmethod
+	def includes(cls, a, b):
+		if type(a) != type(b):
+			raise ValueError('Machines have different types')
+		if isinstance(a, MooreMachine):
+			a = cls.__deterministic_view(a)
+			b = cls.__deterministic_view(b)
+			witness = cls.__shortest_witness(a, b, lambda x, y: not y <= x)
+			return witness is None, witness
+		a_states = a._FSM__states
+		b_states = b._FSM__states
+		a_final = set(a._FSM__final_states)
+		b_final = set(b._FSM__final_states)
+		a_cache = {}
+		b_cache = {}
+		a_start = cls.__closure(a_states, [a._FSM__current_state], a_cache)
+		antichain = {}
+		parents = {}
+		queue = deque()
+
+		def visit(p, subset, parent):
+			minimal = antichain.setdefault(p, [])
+			for item in minimal:
+				if item <= subset:
+					return
+			antichain[p] = [item for item in minimal if not subset <= item]
+			antichain[p].append(subset)
+			parents[(p, subset)] = parent
+			queue.append((p, subset))
+
+		for p in sorted(cls.__closure(b_states, [b._FSM__current_state], b_cache)):
+			visit(p, a_start, None)
+		while len(queue) > 0:
+			p, subset = queue.popleft()
+			if p in b_final and subset.isdisjoint(a_final):
+				word = []
+				node = (p, subset)
+				while parents[node] is not None:
+					node, char = parents[node]
+					word.append(char)
+				return False, ''.join(reversed(word))
+			for char in sorted(b_states[p]):
+				if char == FSM.EPSILON:
+					continue
+				targets = []
+				for state in subset:
+					targets += a_states[state].get(char, [])
+				a_next = cls.__closure(a_states, targets, a_cache)
+				for target in sorted(cls.__closure(b_states, b_states[p][char], b_cache)):
+					visit(target, a_next, ((p, subset), char))
+		return True, None
+
+	@classmethod
+	def __trim(cls, fsm):
+		useful = cls.__useful_states(fsm)
+		if len(useful) == len(fsm._FSM__states):
+			return fsm
+		states = fsm._FSM__states
+		final = set(fsm._FSM__final_states)
+		start = fsm._FSM__current_state
+		trimmed = FSM()
+		names = { start: '0' }
+		queue = deque([start])
+		trimmed.add_state('0', start in final)
+		trimmed.set_initial_state('0')
+		while len(queue) > 0:
+			state = queue.popleft()
+			for char in states[state]:
+				target = states[state][char][0]
+				if target not in useful:
+					continue
+				if target not in names:
+					names[target] = str(len(names))
+					queue.append(target)
+					trimmed.add_state(names[target], target in final)
+				trimmed.add_transition(names[state], names[target], char)
+		return trimmed
+
+	@classmethod
+	def product(cls, a, b, accept, minimize=False):
+		cls.__check_deterministic(a)
+		cls.__check_deterministic(b)
+		a_final = set(a._FSM__final_states)
+		b_final = set(b._FSM__final_states)
+		alphabet = sorted(cls.__alphabet(a) | cls.__alphabet(b))
+
+		def is_final(pair):
+			return accept(pair[0] in a_final, pair[1] in b_final)
+
+		def is_dead(pair):
+			a_values = [False] if pair[0] is None else [False, True]
+			b_values = [False] if pair[1] is None else [False, True]
+			for x in a_values:
+				for y in b_values:
+					if accept(x, y):
+						return False
+			return True
+
+		result = FSM()
+		start = (a._FSM__current_state, b._FSM__current_state)
+		names = { start: '0' }
+		queue = deque([start])
+		result.add_state('0', is_final(start))
+		result.set_initial_state('0')
+		while len(queue) > 0:
+			pair = queue.popleft()
+			for char in alphabet:
+				target = (cls.__step(a, pair[0], char), cls.__step(b, pair[1], char))
+				if is_dead(target):
+					continue
+				if target not in names:
+					names[target] = str(len(names))
+					queue.append(target)
+					result.add_state(names[target], is_final(target))
+				result.add_transition(names[pair], names[target], char)
+		result = cls.__trim(result)
+		if minimize:
+			return FSMBuilder.minimize(result)
+		return result
+
+	@classmethod
+	def intersection(cls, a, b, minimize=False):
+		return cls.product(a, b, lambda x, y: x and y, minimize)
+
+	@classmethod
+	def union(cls, a, b, minimize=False):
+		return cls.product(a, b, lambda x, y: x or y, minimize)
+
+	@classmethod
+	def difference(cls, a, b, minimize=False):
+		return cls.product(a, b, lambda x, y: x and not y, minimize)
+
+	@classmethod
+	def symmetric_difference(cls, a, b, minimize=False):
+		return cls.product(a, b, lambda x, y: x != y, minimize)
+
+	@classmethod
+	def complement(cls, a, alphabet=None, minimize=False):
+		cls.__check_deterministic(a)
+		chars = cls.__alphabet(a)
+		if alphabet is not None:
+			chars |= set(alphabet)
+		chars = sorted(chars)
+		a_final = set(a._FSM__final_states)
+		result = FSM()
+		start = a._FSM__current_state
+		names = { start: '0' }
+		queue = deque([start])
+		result.add_state('0', start not in a_final)
+		result.set_initial_state('0')
+		while len(queue) > 0:
+			state = queue.popleft()
+			for char in chars:
+				target = cls.__step(a, state, char)
+				if target not in names:
+					names[target] = str(len(names))
+					queue.append(target)
+					result.add_state(names[target], target not in a_final)
+				result.add_transition(names[state], names[target], char)
+		result = cls.__trim(result)
+		if minimize:
+			return FSMBuilder.minimize(result)
+		return result
+
+	@classmethod
+	def __useful_states(cls, fsm):
+		states = fsm._FSM__states
+		reverse = {}
+		for state in states:
+			for char in states[state]:
+				reverse.setdefault(states[state][char][0], []).append(state)
+		useful = set(fsm._FSM__final_states)
+		queue = deque(useful)
+		while len(queue) > 0:
+			for source in reverse.get(queue.popleft(), []):
+				if source not in useful:
+					useful.add(source)
+					queue.append(source)
+		reachable = set([fsm._FSM__current_state]) & useful
+		queue = deque(reachable)
+		while len(queue) > 0:
+			state = queue.popleft()
+			for char in states[state]:
+				target = states[state][char][0]
+				if target in useful and target not in reachable:
+					reachable.add(target)
+					queue.append(target)
+		return reachable
+
+	@classmethod
+	def count_words(cls, fsm, length):
+		import numpy
+
+		cls.__check_deterministic(fsm)
+		if length < 0:
+			raise ValueError('Length must not be negative')
+		useful = cls.__useful_states(fsm)
+		if len(useful) == 0:
+			return 0
+		index = {}
+		for state in fsm._FSM__states:
+			if state in useful:
+				index[state] = len(index)
+		size = len(index)
+		limit = numpy.iinfo(numpy.int64).max
+		matrix = numpy.zeros((size, size), dtype=numpy.int64)
+		for state in index:
+			for char, targets in fsm._FSM__states[state].items():
+				if targets[0] in index:
+					matrix[index[state], index[targets[0]]] += 1
+		vector = numpy.zeros(size, dtype=numpy.int64)
+		vector[index[fsm._FSM__current_state]] = 1
+
+		def multiply(x, y):
+			if x.dtype != object and int(x.max()) * int(y.max()) * size > limit:
+				x = x.astype(object)
+				y = y.astype(object)
+			elif x.dtype != y.dtype:
+				x = x.astype(object)
+				y = y.astype(object)
+			return x @ y
+
+		while length > 0:
+			if length & 1:
+				vector = multiply(vector, matrix)
+			length >>= 1
+			if length > 0:
+				matrix = multiply(matrix, matrix)
+		return int(sum(int(vector[index[state]]) for state in fsm._FSM__final_states if state in index))
+
+	@classmethod
+	def enumerate_words(cls, fsm, limit=None, max_length=None):
+		cls.__check_deterministic(fsm)
+		useful = cls.__useful_states(fsm)
+		if len(useful) == 0:
+			return
+		states = fsm._FSM__states
+		rows = {}
+		for state in useful:
+			rows[state] = [(char, states[state][char][0]) for char in sorted(states[state]) if states[state][char][0] in useful]
+		start = fsm._FSM__current_state
+		live = [set(fsm._FSM__final_states) & useful]
+		frontier = set([start])
+		length = 0
+		count = 0
+		while len(frontier) > 0 and (max_length is None or length <= max_length):
+			while len(live) <= length:
+				live.append(set(state for state in useful if any(target in live[-1] for char, target in rows[state])))
+			if start in live[length]:
+				word = []
+				stack = [iter(rows[start])]
+				while len(stack) > 0:
+					if len(stack) > length:
+						yield ''.join(word)
+						count += 1
+						if limit is not None and count >= limit:
+							return
+						stack.pop()
+						if len(word) > 0:
+							word.pop()
+						continue
+					for char, target in stack[-1]:
+						if target in live[length - len(stack)]:
+							word.append(char)
+							stack.append(iter(rows[target]))
+							break
+					else:
+						stack.pop()
+						if len(word) > 0:
+							word.pop()
+			frontier = set(target for state in frontier for char, target in rows[state])
+			length += 1
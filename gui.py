@@ -1,28 +1,80 @@
+import time
+import queue
+import threading
 from tkinter import *
 from core import *
 
+class BuildCancelled(Exception):
+	pass
+
+messages = queue.Queue()
+cancel_event = threading.Event()
+worker = None
+last_report = 0.0
+
+def report(text, force=False):
+	global last_report
+	if cancel_event.is_set():
+		raise BuildCancelled()
+	now = time.monotonic()
+	if force or now - last_report > 0.1:
+		last_report = now
+		messages.put(('status', text))
+
+def report_progress(processed, discovered):
+	report('Determinizing: %d of %d states processed' % (processed, discovered))
+
+def run_build(build, test_cases):
+	try:
+		report('Building...', True)
+		d = build(report_progress).compile()
+		messages.put(('clear', None))
+		for i in range(len(test_cases)):
+			report('Testing: %d of %d cases done' % (i, len(test_cases)))
+			messages.put(('result', '%s %s' % (test_cases[i], d.acceptance(test_cases[i]))))
+		messages.put(('status', 'Done'))
+	except BuildCancelled:
+		messages.put(('status', 'Cancelled'))
+	except Exception as e:
+		messages.put(('status', 'Error: %s' % e))
+
+def start_build(build):
+	global worker
+	if worker is not None and worker.is_alive():
+		return
+	test_cases = list(filter(lambda x: len(x) > 0, test_text.get('1.0', 'end').split("\n")))
+	cancel_event.clear()
+	worker = threading.Thread(target=run_build, args=(build, test_cases), daemon=True)
+	worker.start()
+
+def poll_messages():
+	try:
+		while True:
+			kind, text = messages.get_nowait()
+			if kind == 'clear':
+				test_text.delete('1.0', 'end')
+			elif kind == 'result':
+				test_text.insert('end', text + '\n')
+			else:
+				status_label.config(text=text)
+	except queue.Empty:
+		pass
+	root.after(100, poll_messages)
+
 def build_fsm_handler(event):
-	test_cases = filter(lambda x: len(x) > 0, test_text.get('1.0', 'end').split("\n")) 
-	d = FSMBuilder.build_determined(Lexer.tokenize(regex_entry.get()))
-	result = '\n'.join(['%s %s' % (case, d.acceptance(case)) for case in test_cases])
-	test_text.delete('1.0', 'end')
-	test_text.insert('1.0', result)
+	tokens = Lexer.tokenize(regex_entry.get())
+	start_build(lambda progress: FSMBuilder.build_determined(tokens, progress))
 
 def build_moore_handler(event):
-	test_cases = filter(lambda x: len(x) > 0, test_text.get('1.0', 'end').split("\n"))
 	tokens_lists = [Lexer.tokenize(item.strip()) for item in regex_entry.get().split(',')]
-	d = MooreMachineBuilder.build_moore(tokens_lists)
-	result = '\n'.join(['%s %s' % (case, d.acceptance(case)) for case in test_cases])
-	test_text.delete('1.0', 'end')
-	test_text.insert('1.0', result)
+	start_build(lambda progress: MooreMachineBuilder.build_moore(tokens_lists, progress))
 
 def build_buchi_handler(event):
-	test_cases = filter(lambda x: len(x) > 0, test_text.get('1.0', 'end').split("\n"))
 	tokens_lists = [Lexer.tokenize(item.strip()) for item in regex_entry.get().split(',')]
-	d = BuchiMachineBuilder.build_buchi(tokens_lists)
-	result = '\n'.join(['%s %s' % (case, d.acceptance(case)) for case in test_cases])
-	test_text.delete('1.0', 'end')
-	test_text.insert('1.0', result)
+	start_build(lambda progress: BuchiMachineBuilder.build_buchi(tokens_lists, progress))
+
+def cancel_handler(event):
+	cancel_event.set()
 
 root = Tk()
 regex_label = Label(root, text="Regular expression")
@@ -32,10 +84,13 @@ test_text = Text(root, wrap='word')
 build_fsm = Button(root, text='Build FSM')
 build_moore = Button(root, text='Build Moore')
 build_buchi = Button(root, text='Build Buchi')
+cancel = Button(root, text='Cancel')
+status_label = Label(root, text="Ready")
 
 build_fsm.bind('<Button-1>', build_fsm_handler)
 build_moore.bind('<Button-1>', build_moore_handler)
 build_buchi.bind('<Button-1>', build_buchi_handler)
+cancel.bind('<Button-1>', cancel_handler)
 
 regex_label.pack()
 regex_entry.pack()
@@ -44,5 +99,8 @@ test_text.pack()
 build_fsm.pack()
 build_moore.pack()
 build_buchi.pack()
+cancel.pack()
+status_label.pack()
 
+root.after(100, poll_messages)
 root.mainloop()